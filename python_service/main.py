@@ -5,13 +5,17 @@ Lightweight enough to run on 8GB RAM laptops.
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional
+from functools import lru_cache
+import os
+import threading
 import pandas as pd
 import numpy as np
 from model import DrugRecommender
 
-app = FastAPI(title="Drug Recommendation SHAP Service")
+app = FastAPI(title="Drug Recommendation SHAP Service", default_response_class=ORJSONResponse)
 
 # CORS for Node backend
 app.add_middleware(
@@ -22,8 +26,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize model (loads on startup)
+# Initialize model (loads on startup, or at import when PRELOAD_MODEL is set)
 recommender = None
+_recommender_lock = threading.Lock()
+
+# Validate /predict output against PredictionResponse (slower; for debugging)
+VALIDATE_RESPONSES = os.environ.get("VALIDATE_RESPONSES") == "1"
 
 class PatientInput(BaseModel):
     age: int
@@ -33,7 +41,7 @@ class PatientInput(BaseModel):
     allergies: List[str]
     medical_history: List[str]
     symptoms: List[str]
-    current_medications: List[str]
+    current_medications: str
 
 class DrugRecommendation(BaseModel):
     name: str
@@ -60,38 +68,85 @@ class PredictionResponse(BaseModel):
     explanations: List[ShapExplanation]
     interactions: List[DrugInteraction]
 
+def get_recommender() -> DrugRecommender:
+    """Load the recommender once per process; later calls reuse it."""
+    global recommender
+    with _recommender_lock:
+        if recommender is None:
+            print("Loading drug recommendation model...")
+            model = DrugRecommender()
+            model.load_and_train()
+            recommender = model
+            _predict_cached.cache_clear()
+            print("Model loaded successfully!")
+    return recommender
+
 @app.on_event("startup")
 async def load_model():
-    global recommender
-    print("Loading drug recommendation model...")
-    recommender = DrugRecommender()
-    recommender.load_and_train()
-    print("Model loaded successfully!")
+    get_recommender()
+
+def _patient_key(patient: PatientInput) -> tuple:
+    """Canonicalize patient input so equivalent requests share a cache entry."""
+    # Allergies keep their original casing: they are echoed back in interaction text
+    return (
+        patient.age,
+        patient.gender,
+        patient.heart_rate,
+        patient.blood_type,
+        tuple(sorted(patient.allergies)),
+        tuple(sorted(map(str.lower, patient.medical_history))),
+        tuple(sorted(map(str.lower, patient.symptoms))),
+        patient.current_medications.lower().strip()
+    )
+
+@lru_cache(maxsize=4096)
+def _predict_cached(key: tuple) -> dict:
+    (age, gender, heart_rate, blood_type,
+     allergies, medical_history, symptoms, current_medications) = key
+    return recommender.predict(
+        age=age,
+        gender=gender,
+        heart_rate=heart_rate,
+        blood_type=blood_type,
+        allergies=list(allergies),
+        medical_history=list(medical_history),
+        symptoms=list(symptoms),
+        current_medications=current_medications
+    )
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "model_loaded": recommender is not None}
 
-@app.post("/predict", response_model=PredictionResponse)
+@app.post("/predict", response_model=None, responses={200: {"model": PredictionResponse}})
 async def predict(patient: PatientInput):
     if recommender is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
     try:
-        result = recommender.predict(
-            age=patient.age,
-            gender=patient.gender,
-            heart_rate=patient.heart_rate,
-            blood_type=patient.blood_type,
-            allergies=patient.allergies,
-            medical_history=patient.medical_history,
-            symptoms=patient.symptoms,
-            current_medications=patient.current_medications
-        )
-        return result
+        result = _predict_cached(_patient_key(patient))
+        if VALIDATE_RESPONSES:
+            result = PredictionResponse(**result).model_dump()
+        # Plain dicts go straight to orjson, skipping response model validation
+        return ORJSONResponse(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Under `gunicorn --preload` the model is fitted once in the master process and
+# the read-only arrays are shared with forked workers via copy-on-write. Not
+# applied to `python main.py`: uvicorn's parent never serves requests and its
+# spawned workers re-import this module anyway.
+if os.environ.get("PRELOAD_MODEL") == "1" and __name__ != "__main__":
+    get_recommender()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        # Each uvicorn worker holds its own model copy; keep the default small
+        workers=int(os.environ.get("WEB_CONCURRENCY", min(2, os.cpu_count() or 1))),
+        loop="auto",  # uvloop when installed
+        http="auto"   # httptools when installed
+    )
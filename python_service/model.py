@@ -1,45 +1,198 @@
 """
 Drug Recommendation Model with SHAP Explainability.
-Uses drugLib dataset for training a lightweight Random Forest model.
+Uses drugLib dataset for training a lightweight decision tree model.
 """
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+from sklearn.tree import DecisionTreeClassifier
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.model_selection import train_test_split
 import shap
+import joblib
+import ahocorasick
+from numba import njit
 import os
-from typing import List, Dict, Any
+import re
+import sys
+import tempfile
+from itertools import chain
+from typing import List, Dict, Any, FrozenSet, Set
+
+# Composite score weights for [avg_rating, avg_effectiveness, avg_side_effects, review_count]
+SCORE_WEIGHTS = np.array([0.3, 2.0, -0.5, 0.1], dtype=np.float32)
+
+# Label codes returned by score_and_label, ordered from lowest to highest
+EFFECTIVENESS_LABELS = ('Marginally Effective', 'Moderately Effective',
+                        'Considerably Effective', 'Highly Effective')
+SIDE_EFFECT_LABELS = ('Low Risk', 'Mild Risk', 'Moderate Risk', 'High Risk')
+
+# Patient symptom / history term -> dataset condition keywords
+SYMPTOM_CONDITION_MAP = {
+    symptom: frozenset(conditions) for symptom, conditions in {
+        'fever': ['infection', 'flu', 'cold', 'virus'],
+        'cough': ['cold', 'flu', 'bronchitis', 'asthma', 'infection'],
+        'headache': ['migraine', 'tension headache', 'pain', 'headache'],
+        'fatigue': ['depression', 'chronic fatigue', 'anemia'],
+        'nausea': ['nausea', 'vomiting', 'morning sickness', 'motion sickness'],
+        'dizziness': ['vertigo', 'dizziness', 'hypertension'],
+        'chest pain': ['angina', 'heart', 'cardiac'],
+        'shortness of breath': ['asthma', 'copd', 'bronchitis', 'heart failure'],
+        'joint pain': ['arthritis', 'pain', 'inflammation'],
+        'muscle aches': ['pain', 'fibromyalgia', 'muscle'],
+        'sore throat': ['infection', 'strep', 'pharyngitis', 'throat'],
+        'runny nose': ['cold', 'allergy', 'rhinitis', 'sinusitis'],
+        'diabetes': ['diabetes', 'blood sugar'],
+        'hypertension': ['hypertension', 'high blood pressure', 'blood pressure'],
+        'asthma': ['asthma', 'breathing', 'bronchial'],
+        'heart disease': ['heart', 'cardiac', 'cardiovascular'],
+        'depression': ['depression', 'mood', 'mental'],
+        'anxiety': ['anxiety', 'panic', 'stress']
+    }.items()
+}
+
+# Known interaction pairs
+INTERACTION_PAIRS = {
+    'warfarin': ['aspirin', 'ibuprofen', 'naproxen'],
+    'metformin': ['contrast dye'],
+    'lisinopril': ['potassium', 'nsaids'],
+    'simvastatin': ['grapefruit', 'erythromycin'],
+    'sertraline': ['tramadol', 'triptans'],
+    'omeprazole': ['clopidogrel']
+}
+
+
+def _object_memory(column: pd.Series) -> int:
+    """Bytes a categorical column would take as an object column of Python strings."""
+    sizes = np.array([sys.getsizeof(c) for c in column.cat.categories], dtype=np.int64)
+    codes = column.cat.codes.to_numpy()
+    return int(sizes[codes[codes >= 0]].sum()) + 8 * len(column)
+
+
+@njit(cache=True)
+def score_and_label(feat, review_count, rows):
+    """Score the given feature rows and bucket their effectiveness/side effect levels."""
+    n = rows.shape[0]
+    scores = np.empty(n, dtype=np.float32)
+    eff_lbl = np.empty(n, dtype=np.int8)
+    se_lbl = np.empty(n, dtype=np.int8)
+    
+    for k in range(n):
+        r = rows[k]
+        eff = feat[r, 1]
+        se = feat[r, 2]
+        
+        # Composite score: high rating + high effectiveness - side effects
+        scores[k] = (feat[r, 0] * SCORE_WEIGHTS[0] +
+                     eff * SCORE_WEIGHTS[1] +
+                     se * SCORE_WEIGHTS[2] +
+                     min(review_count[r], 20) * SCORE_WEIGHTS[3])
+        
+        # Threshold counts index into EFFECTIVENESS_LABELS / SIDE_EFFECT_LABELS
+        eff_lbl[k] = (eff >= 2.5) + (eff >= 3.5) + (eff >= 4.5)
+        se_lbl[k] = (se > 1.5) + (se > 2.5) + (se > 3.5)
+    
+    return scores, eff_lbl, se_lbl
+
 
 class DrugRecommender:
+    # Fitted state persisted by _save_state and restored by _load_state;
+    # bump CACHE_VERSION whenever the layout of these attributes changes
+    CACHE_VERSION = 5
+    CACHED_ATTRS = (
+        'model', 'features', 'drug_info',
+        '_drug_names', '_drug_codes', '_condition_names', '_feat', '_review_count',
+        '_condition_slots', '_condition_order', '_condition_offsets', '_trigram_to_conditions'
+    )
+    # joblib memory-maps every array separately and each map holds a file
+    # descriptor, so the cache must only contain a handful of flat arrays
+    MAX_CACHED_ARRAYS = 32
+    
     def __init__(self):
         self.model = None
         self.label_encoder = LabelEncoder()
         self.scaler = StandardScaler()
         self.tfidf = TfidfVectorizer(max_features=100, stop_words='english')
         self.drug_data = None
-        self.condition_drug_map = {}
         self.drug_info = {}
+        self.features = None
+        self._drug_names = None
+        self._drug_codes = None
+        self._condition_names = None
+        self._feat = None
+        self._review_count = None
+        self._condition_slots = {}
+        self._condition_order = None
+        self._condition_offsets = None
+        self._trigram_to_conditions = {}
         self.explainer = None
         
+        # Bidirectional interaction graph over every drug/substance term
+        self._interaction_graph: Dict[str, Set[str]] = {}
+        for med, conflicts in INTERACTION_PAIRS.items():
+            for conflict in conflicts:
+                self._interaction_graph.setdefault(med, set()).add(conflict)
+                self._interaction_graph.setdefault(conflict, set()).add(med)
+        self._all_interaction_terms = frozenset(self._interaction_graph)
+        
     def load_and_train(self):
         """Load drugLib data and train the recommendation model."""
         data_dir = os.path.dirname(os.path.abspath(__file__))
         train_path = os.path.join(data_dir, 'data', 'drugLibTrain_raw.tsv')
         test_path = os.path.join(data_dir, 'data', 'drugLibTest_raw.tsv')
-        
-        # Load datasets
-        train_df = pd.read_csv(train_path, sep='\t')
-        test_df = pd.read_csv(test_path, sep='\t')
-        
-        # Combine for full dataset
-        self.drug_data = pd.concat([train_df, test_df], ignore_index=True)
+        cache_path = os.path.join(data_dir, 'recommender.joblib')
+        
+        # Reuse the fitted state if it is newer than both datasets
+        data_mtime = max(os.path.getmtime(train_path), os.path.getmtime(test_path))
+        if (os.path.exists(cache_path)
+                and os.path.getmtime(cache_path) > data_mtime
+                and self._load_state(cache_path)):
+            return
+        
+        # Stream both datasets through one scan: only the columns used below are
+        # projected and incomplete rows are filtered before anything is materialized
+        category_columns = ['urlDrugName', 'condition', 'effectiveness', 'sideEffects']
+        category_type = pa.dictionary(pa.int32(), pa.string())
+        file_format = ds.CsvFileFormat(
+            parse_options=pa_csv.ParseOptions(delimiter='\t', newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={'rating': pa.float32(),
+                              **{column: category_type for column in category_columns}},
+                strings_can_be_null=True
+            )
+        )
+        dataset = ds.dataset([train_path, test_path], format=file_format)
+        table = dataset.to_table(
+            columns=category_columns + ['rating', 'benefitsReview', 'sideEffectsReview'],
+            filter=(ds.field('urlDrugName').is_valid() &
+                    ds.field('condition').is_valid() &
+                    ds.field('effectiveness').is_valid())
+        )
+        
+        # Dictionary columns arrive as pandas categoricals
+        self.drug_data = table.to_pandas()
         
         # Clean data
-        self.drug_data = self.drug_data.dropna(subset=['urlDrugName', 'condition', 'effectiveness'])
-        self.drug_data['condition'] = self.drug_data['condition'].str.lower().str.strip()
-        self.drug_data['urlDrugName'] = self.drug_data['urlDrugName'].str.lower().str.strip()
+        for column in ('condition', 'urlDrugName'):
+            # Normalize the (few) categories rather than every row; merges
+            # categories that only differed by case or whitespace
+            categories = self.drug_data[column].cat.categories
+            self.drug_data[column] = self.drug_data[column].map(
+                dict(zip(categories, categories.str.lower().str.strip()))
+            ).astype('category')
+        
+        # Compare against the same frame with plain string columns
+        memory_after = self.drug_data.memory_usage(deep=True).sum()
+        memory_before = memory_after + sum(
+            _object_memory(self.drug_data[column])
+            - self.drug_data[column].memory_usage(deep=True, index=False)
+            for column in category_columns
+        )
+        print(f"Drug data memory: {memory_before / 1e6:.1f} MB as strings -> "
+              f"{memory_after / 1e6:.1f} MB categorical")
         
         # Build condition -> drug mapping with effectiveness scores
         self._build_drug_mappings()
@@ -47,6 +200,71 @@ class DrugRecommender:
         # Prepare features for ML model
         self._prepare_model()
         
+        self._save_state(cache_path)
+    
+    def _save_state(self, path: str):
+        """Persist the fitted model and lookup tables so restarts skip training."""
+        # Uncompressed so the NumPy arrays can be memory-mapped on load
+        state = {attr: getattr(self, attr) for attr in self.CACHED_ATTRS}
+        state['version'] = self.CACHE_VERSION
+        
+        array_count = self._count_arrays(state)
+        if array_count > self.MAX_CACHED_ARRAYS:
+            print(f"Warning: not saving model cache; {array_count} arrays would each "
+                  f"need a file descriptor when memory-mapped")
+            return
+        
+        # Write to a temp file and rename, so concurrently starting workers
+        # never see a half-written cache
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            os.close(fd)
+            joblib.dump(state, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Warning: could not save model cache to {path}: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+    
+    @staticmethod
+    def _count_arrays(value) -> int:
+        """Count the NumPy arrays in value, looking inside containers and objects."""
+        if isinstance(value, np.ndarray):
+            return 1
+        if isinstance(value, dict):
+            return sum(DrugRecommender._count_arrays(v) for v in value.values())
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return sum(DrugRecommender._count_arrays(v) for v in value)
+        if isinstance(value, pd.Categorical):
+            return 1  # codes
+        if hasattr(value, '__dict__'):
+            return DrugRecommender._count_arrays(vars(value))
+        return 0
+    
+    def _load_state(self, path: str) -> bool:
+        """Restore state written by _save_state; returns False if it is stale or unreadable."""
+        try:
+            # Memory-mapped arrays are read-only and shared between worker processes
+            state = joblib.load(path, mmap_mode='r')
+            if state.get('version') != self.CACHE_VERSION:
+                return False
+            values = {attr: state[attr] for attr in self.CACHED_ATTRS}
+        except Exception as e:
+            print(f"Warning: ignoring unreadable model cache {path}: {e}")
+            return False
+        
+        for attr, value in values.items():
+            setattr(self, attr, value)
+        
+        if self.model is not None:
+            self._init_explainer()
+        self._warm_up_scoring()
+        return True
+        
     def _build_drug_mappings(self):
         """Build mappings of conditions to drugs with their stats."""
         effectiveness_map = {
@@ -65,177 +283,192 @@ class DrugRecommender:
             'Extremely Severe Side Effects': 5
         }
         
-        for _, row in self.drug_data.iterrows():
-            condition = row['condition']
-            drug = row['urlDrugName']
-            
-            if condition not in self.condition_drug_map:
-                self.condition_drug_map[condition] = {}
-            
-            if drug not in self.condition_drug_map[condition]:
-                self.condition_drug_map[condition][drug] = {
-                    'ratings': [],
-                    'effectiveness_scores': [],
-                    'side_effect_scores': [],
-                    'reviews': []
-                }
-            
-            self.condition_drug_map[condition][drug]['ratings'].append(
-                row.get('rating', 5)
-            )
-            self.condition_drug_map[condition][drug]['effectiveness_scores'].append(
-                effectiveness_map.get(row.get('effectiveness', 'Moderately Effective'), 3)
-            )
-            self.condition_drug_map[condition][drug]['side_effect_scores'].append(
-                side_effects_map.get(row.get('sideEffects', 'Mild Side Effects'), 2)
-            )
-            
-            # Store drug info
-            if drug not in self.drug_info:
-                self.drug_info[drug] = {
-                    'effectiveness': row.get('effectiveness', 'Unknown'),
-                    'sideEffects': row.get('sideEffects', 'Unknown'),
-                    'benefitsReview': row.get('benefitsReview', ''),
-                    'sideEffectsReview': row.get('sideEffectsReview', '')
-                }
+        # Score every review in one vectorized pass, then aggregate per (condition, drug)
+        data = self.drug_data.assign(
+            eff_score=self.drug_data['effectiveness'].map(effectiveness_map)
+                .astype(np.float32).fillna(3).astype(np.int8),
+            se_score=self.drug_data['sideEffects'].map(side_effects_map)
+                .astype(np.float32).fillna(2).astype(np.int8)
+        )
+        grouped = data.groupby(['condition', 'urlDrugName'], sort=False, observed=True).agg(
+            avg_rating=('rating', 'mean'),
+            avg_effectiveness=('eff_score', 'mean'),
+            avg_side_effects=('se_score', 'mean'),
+            review_count=('eff_score', 'size')
+        )
+        
+        # Structure-of-arrays view of the same table, one row per (condition, drug)
+        self._condition_names = pd.Categorical(grouped.index.get_level_values('condition'))
+        self._drug_names = pd.Categorical(grouped.index.get_level_values('urlDrugName'))
+        self._drug_codes = self._drug_names.codes
+        self._feat = grouped[
+            ['avg_rating', 'avg_effectiveness', 'avg_side_effects']
+        ].to_numpy(dtype=np.float32)
+        self._review_count = grouped['review_count'].to_numpy(dtype=np.int16)
+        
+        # Flat condition -> rows index: row ids grouped by condition, with
+        # _condition_offsets[slot]:_condition_offsets[slot + 1] bounding each group
+        condition_codes = self._condition_names.codes
+        counts = np.bincount(condition_codes, minlength=len(self._condition_names.categories))
+        self._condition_order = np.argsort(condition_codes, kind='stable').astype(np.int32)
+        self._condition_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+        self._condition_slots = {
+            condition: slot
+            for slot, condition in enumerate(self._condition_names.categories)
+            if counts[slot]
+        }
+        
+        # Inverted index from character trigrams to the conditions containing them
+        self._trigram_to_conditions: Dict[str, Set[str]] = {}
+        for condition in self._condition_slots:
+            for trigram in self._trigrams(condition):
+                self._trigram_to_conditions.setdefault(trigram, set()).add(condition)
+        
+        # Store drug info (first review seen for each drug)
+        info_columns = ['effectiveness', 'sideEffects', 'benefitsReview', 'sideEffectsReview']
+        self.drug_info = (
+            data.drop_duplicates('urlDrugName')
+            .set_index('urlDrugName')[info_columns]
+            .to_dict('index')
+        )
     
     def _prepare_model(self):
         """Prepare and train the ML model for drug scoring."""
-        # Create feature matrix from drug data
-        features = []
-        labels = []
-        
-        for condition, drugs in self.condition_drug_map.items():
-            for drug, stats in drugs.items():
-                avg_rating = np.mean(stats['ratings'])
-                avg_effectiveness = np.mean(stats['effectiveness_scores'])
-                avg_side_effects = np.mean(stats['side_effect_scores'])
-                review_count = len(stats['ratings'])
-                
-                # Feature vector: [avg_rating, avg_effectiveness, avg_side_effects, review_count]
-                features.append([
-                    avg_rating,
-                    avg_effectiveness,
-                    avg_side_effects,
-                    min(review_count, 100)  # Cap review count
-                ])
-                
-                # Label: good drug (1) if rating >= 7 and effectiveness >= 4
-                labels.append(1 if avg_rating >= 7 and avg_effectiveness >= 4 else 0)
-        
-        if len(features) > 10:
-            X = np.array(features)
-            y = np.array(labels)
+        # Feature vector: [avg_rating, avg_effectiveness, avg_side_effects, review_count]
+        self.features = np.column_stack([
+            self._feat,
+            np.minimum(self._review_count, 100)  # Cap review count
+        ]).astype(np.float32)
+        
+        if len(self.features) > 10:
+            X = self.features
+            # Label: good drug (1) if rating >= 7 and effectiveness >= 4
+            y = ((X[:, 0] >= 7) & (X[:, 1] >= 4)).astype(np.int8)
             
-            # Train Random Forest (lightweight)
-            self.model = RandomForestClassifier(
-                n_estimators=50,  # Lightweight for 8GB RAM
-                max_depth=10,
-                random_state=42,
-                n_jobs=-1
+            # Train a single shallow tree: 4 features don't need an ensemble,
+            # and TreeExplainer cost grows linearly with the number of trees
+            self.model = DecisionTreeClassifier(
+                max_depth=6,
+                random_state=42
             )
             self.model.fit(X, y)
             
             # Initialize SHAP explainer
-            self.explainer = shap.TreeExplainer(self.model)
+            self._init_explainer()
+        
+        self._warm_up_scoring()
+    
+    def _warm_up_scoring(self):
+        """Compile (or load from cache) the scoring kernel before the first request."""
+        if len(self._feat):
+            # Same argument types as _find_drugs_for_conditions: the stored
+            # arrays plus a freshly concatenated int32 row index
+            score_and_label(self._feat, self._review_count, np.zeros(1, dtype=np.int32))
+    
+    def _init_explainer(self):
+        """Create the SHAP explainer and warm it up before the first request."""
+        self.explainer = shap.TreeExplainer(self.model)
+        self.explainer.shap_values(self.features[:1], check_additivity=False)
             
-    def _match_condition(self, symptoms: List[str], medical_history: List[str]) -> List[str]:
+    def _match_condition(self, symptoms: List[str], medical_history: List[str]) -> FrozenSet[str]:
         """Match patient symptoms/history to conditions in dataset."""
-        symptom_condition_map = {
-            'fever': ['infection', 'flu', 'cold', 'virus'],
-            'cough': ['cold', 'flu', 'bronchitis', 'asthma', 'infection'],
-            'headache': ['migraine', 'tension headache', 'pain', 'headache'],
-            'fatigue': ['depression', 'chronic fatigue', 'anemia'],
-            'nausea': ['nausea', 'vomiting', 'morning sickness', 'motion sickness'],
-            'dizziness': ['vertigo', 'dizziness', 'hypertension'],
-            'chest pain': ['angina', 'heart', 'cardiac'],
-            'shortness of breath': ['asthma', 'copd', 'bronchitis', 'heart failure'],
-            'joint pain': ['arthritis', 'pain', 'inflammation'],
-            'muscle aches': ['pain', 'fibromyalgia', 'muscle'],
-            'sore throat': ['infection', 'strep', 'pharyngitis', 'throat'],
-            'runny nose': ['cold', 'allergy', 'rhinitis', 'sinusitis'],
-            'diabetes': ['diabetes', 'blood sugar'],
-            'hypertension': ['hypertension', 'high blood pressure', 'blood pressure'],
-            'asthma': ['asthma', 'breathing', 'bronchial'],
-            'heart disease': ['heart', 'cardiac', 'cardiovascular'],
-            'depression': ['depression', 'mood', 'mental'],
-            'anxiety': ['anxiety', 'panic', 'stress']
-        }
-        
-        matched_conditions = set()
-        
-        for symptom in symptoms:
-            symptom_lower = symptom.lower()
-            if symptom_lower in symptom_condition_map:
-                matched_conditions.update(symptom_condition_map[symptom_lower])
-        
-        for condition in medical_history:
-            condition_lower = condition.lower()
-            if condition_lower in symptom_condition_map:
-                matched_conditions.update(symptom_condition_map[condition_lower])
-        
-        return list(matched_conditions)
+        return frozenset().union(*(
+            SYMPTOM_CONDITION_MAP.get(term.lower(), ())
+            for term in chain(symptoms, medical_history)
+        ))
+    
+    @staticmethod
+    def _trigrams(text: str) -> Set[str]:
+        """Return the set of 3-character substrings of text."""
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+    
+    def _lookup_condition(self, condition: str) -> Set[str]:
+        """Find dataset conditions containing the given condition name."""
+        trigrams = self._trigrams(condition)
+        if not trigrams:
+            # Too short to index; scan every condition
+            return {db_condition for db_condition in self._condition_slots if condition in db_condition}
+        
+        # Any condition containing the query contains all of its trigrams, so the
+        # posting-set intersection is a superset of the substring matches
+        postings = sorted((self._trigram_to_conditions.get(t, set()) for t in trigrams), key=len)
+        candidates = set.intersection(*postings)
+        return {db_condition for db_condition in candidates if condition in db_condition}
     
-    def _find_drugs_for_conditions(self, conditions: List[str]) -> List[Dict]:
+    def _condition_rows(self, condition: str) -> np.ndarray:
+        """Return the feature-table rows belonging to a dataset condition."""
+        slot = self._condition_slots[condition]
+        return self._condition_order[self._condition_offsets[slot]:self._condition_offsets[slot + 1]]
+    
+    def _find_drugs_for_conditions(self, conditions: FrozenSet[str]) -> List[Dict]:
         """Find best drugs for matched conditions."""
-        drug_scores = {}
-        
+        # Fuzzy match conditions
+        matched = set()
         for condition in conditions:
-            for db_condition, drugs in self.condition_drug_map.items():
-                # Fuzzy match conditions
-                if any(c in db_condition for c in conditions) or condition in db_condition:
-                    for drug, stats in drugs.items():
-                        avg_rating = np.mean(stats['ratings'])
-                        avg_effectiveness = np.mean(stats['effectiveness_scores'])
-                        avg_side_effects = np.mean(stats['side_effect_scores'])
-                        review_count = len(stats['ratings'])
-                        
-                        # Composite score: high rating + high effectiveness - side effects
-                        score = (avg_rating * 0.3 + 
-                                avg_effectiveness * 2.0 - 
-                                avg_side_effects * 0.5 +
-                                min(review_count, 20) * 0.1)
-                        
-                        if drug not in drug_scores or score > drug_scores[drug]['score']:
-                            drug_scores[drug] = {
-                                'score': score,
-                                'avg_rating': avg_rating,
-                                'avg_effectiveness': avg_effectiveness,
-                                'avg_side_effects': avg_side_effects,
-                                'review_count': review_count,
-                                'condition': db_condition
-                            }
-        
-        # Sort by score and return top drugs
-        sorted_drugs = sorted(drug_scores.items(), key=lambda x: x[1]['score'], reverse=True)
-        return sorted_drugs[:5]
+            matched.update(self._lookup_condition(condition))
+        
+        if not matched:
+            return []
+        
+        idx = np.concatenate([self._condition_rows(c) for c in sorted(matched)])
+        
+        scores, eff_lbl, se_lbl = score_and_label(self._feat, self._review_count, idx)
+        
+        # Keep each drug's best-scoring condition, then take the top drugs
+        order = np.argsort(-scores, kind='stable')
+        _, first = np.unique(self._drug_codes[idx[order]], return_index=True)
+        top = order[np.sort(first)][:5]
+        
+        top_drugs = []
+        for i in top:
+            row = idx[i]
+            top_drugs.append((self._drug_names[row], {
+                'score': float(scores[i]),
+                'avg_rating': float(self._feat[row, 0]),
+                'avg_effectiveness': float(self._feat[row, 1]),
+                'avg_side_effects': float(self._feat[row, 2]),
+                'review_count': int(self._review_count[row]),
+                'condition': self._condition_names[row],
+                'effectiveness_label': EFFECTIVENESS_LABELS[eff_lbl[i]],
+                'side_effects_label': SIDE_EFFECT_LABELS[se_lbl[i]]
+            }))
+        return top_drugs
     
-    def _compute_shap_values(self, drug_stats: Dict) -> List[Dict]:
-        """Compute SHAP values for the recommendation."""
-        if self.model is None or self.explainer is None:
-            return self._fallback_explanations(drug_stats)
+    def _batch_shap_values(self, drug_stats: List[Dict]) -> np.ndarray:
+        """Compute SHAP values for several recommendations in a single explainer call."""
+        if self.model is None or self.explainer is None or not drug_stats:
+            return None
         
-        # Create feature vector for this drug
+        # One feature row per drug
         features = np.array([[
-            drug_stats['avg_rating'],
-            drug_stats['avg_effectiveness'],
-            drug_stats['avg_side_effects'],
-            min(drug_stats['review_count'], 100)
-        ]])
+            stats['avg_rating'],
+            stats['avg_effectiveness'],
+            stats['avg_side_effects'],
+            min(stats['review_count'], 100)
+        ] for stats in drug_stats], dtype=np.float32)
         
-        # Get SHAP values
-        shap_values = self.explainer.shap_values(features)
+        # Get SHAP values (the additivity self-check costs an extra model pass)
+        shap_values = self.explainer.shap_values(features, check_additivity=False)
         
         # Handle binary classification output
         if isinstance(shap_values, list):
             shap_values = shap_values[1]  # Use positive class
+        elif shap_values.ndim == 3:
+            shap_values = shap_values[..., 1]  # (n, features, classes) in newer shap
+        
+        return shap_values
+    
+    def _compute_shap_values(self, drug_stats: Dict, shap_row: np.ndarray = None) -> List[Dict]:
+        """Format one drug's precomputed SHAP values as explanations."""
+        if shap_row is None:
+            return self._fallback_explanations(drug_stats)
         
         feature_names = ['Patient Rating', 'Drug Effectiveness', 'Side Effect Risk', 'Clinical Evidence']
         
         explanations = []
-        for i, (name, value) in enumerate(zip(feature_names, shap_values[0])):
+        for name, value in zip(feature_names, shap_row):
             # Convert to percentage influence
-            influence = abs(value) * 100 / (sum(abs(v) for v in shap_values[0]) + 0.001)
+            influence = abs(value) * 100 / (sum(abs(v) for v in shap_row) + 0.001)
             explanations.append({
                 'feature': name,
                 'influence': round(influence, 1),
@@ -282,43 +515,60 @@ class DrugRecommender:
         
         return sorted(explanations, key=lambda x: x['influence'], reverse=True)
     
-    def _check_interactions(self, drug: str, current_meds: str, allergies: List[str]) -> List[Dict]:
+    @staticmethod
+    def _build_allergy_automaton(allergies: List[str]):
+        """Build a patient-scoped Aho-Corasick automaton over allergy names."""
+        automaton = ahocorasick.Automaton()
+        for allergy in allergies:
+            key = allergy.lower()
+            if key:
+                # Keep every original spelling that lowercases to the same key
+                automaton.add_word(key, automaton.get(key, ()) + (allergy,))
+        
+        if len(automaton) == 0:
+            return None
+        automaton.make_automaton()
+        return automaton
+    
+    @staticmethod
+    def _allergy_hits(automaton, drug: str) -> Set[str]:
+        """Return the allergies whose names occur in the drug name, in one pass."""
+        if automaton is None:
+            return set()
+        return {allergy for _, names in automaton.iter(drug.lower()) for allergy in names}
+    
+    def _check_interactions(self, drug: str, current_meds: str, allergies: List[str],
+                            allergy_automaton=None) -> List[Dict]:
         """Check for drug interactions and allergy conflicts."""
         interactions = []
-        current_meds_lower = current_meds.lower()
-        
-        # Known interaction pairs
-        interaction_pairs = {
-            'warfarin': ['aspirin', 'ibuprofen', 'naproxen'],
-            'metformin': ['contrast dye'],
-            'lisinopril': ['potassium', 'nsaids'],
-            'simvastatin': ['grapefruit', 'erythromycin'],
-            'sertraline': ['tramadol', 'triptans'],
-            'omeprazole': ['clopidogrel']
-        }
+        if allergy_automaton is None:
+            allergy_automaton = self._build_allergy_automaton(allergies)
         
-        for med, conflicts in interaction_pairs.items():
-            if med in current_meds_lower and drug in conflicts:
+        # Tokenize current medications once; bigrams cover multi-word terms like "contrast dye"
+        words = re.findall(r'[a-z]+', current_meds.lower())
+        meds_tokens = set(words) | {' '.join(pair) for pair in zip(words, words[1:])}
+        present = meds_tokens & self._all_interaction_terms
+        
+        for term in sorted(present & self._interaction_graph.get(drug, set())):
+            if drug in INTERACTION_PAIRS.get(term, ()):
                 interactions.append({
-                    'drug1': med,
+                    'drug1': term,
                     'drug2': drug,
                     'severity': 'moderate',
-                    'description': f'{drug.title()} may interact with {med}. Consult physician.'
+                    'description': f'{drug.title()} may interact with {term}. Consult physician.'
+                })
+            if term in INTERACTION_PAIRS.get(drug, ()):
+                interactions.append({
+                    'drug1': drug,
+                    'drug2': term,
+                    'severity': 'high',
+                    'description': f'{drug.title()} has known interaction with {term}. Use caution.'
                 })
-            if drug == med:
-                for conflict in conflicts:
-                    if conflict in current_meds_lower:
-                        interactions.append({
-                            'drug1': drug,
-                            'drug2': conflict,
-                            'severity': 'high',
-                            'description': f'{drug.title()} has known interaction with {conflict}. Use caution.'
-                        })
         
         # Check allergies
+        allergy_hits = self._allergy_hits(allergy_automaton, drug)
         for allergy in allergies:
-            allergy_lower = allergy.lower()
-            if allergy_lower in drug or drug in allergy_lower:
+            if allergy in allergy_hits or drug in allergy.lower():
                 interactions.append({
                     'drug1': drug,
                     'drug2': allergy,
@@ -368,7 +618,7 @@ class DrugRecommender:
         matched_conditions = self._match_condition(symptoms, medical_history)
         
         if not matched_conditions:
-            matched_conditions = ['general', 'pain', 'infection']
+            matched_conditions = frozenset({'general', 'pain', 'infection'})
         
         # Find best drugs for conditions
         top_drugs = self._find_drugs_for_conditions(matched_conditions)
@@ -377,36 +627,21 @@ class DrugRecommender:
         all_explanations = []
         all_interactions = []
         
-        for drug_name, stats in top_drugs[:3]:
-            # Skip drugs patient is allergic to
-            if any(a.lower() in drug_name.lower() for a in allergies):
-                continue
-            
+        allergy_automaton = self._build_allergy_automaton(allergies)
+        
+        # Skip drugs patient is allergic to before any SHAP/dosage work
+        candidates = [
+            (drug_name, stats) for drug_name, stats in top_drugs[:3]
+            if not self._allergy_hits(allergy_automaton, drug_name)
+        ]
+        
+        # Get SHAP values for all candidates at once
+        shap_matrix = self._batch_shap_values([stats for _, stats in candidates])
+        
+        for i, (drug_name, stats) in enumerate(candidates):
             # Get dosage
             dosage, frequency = self._get_dosage_recommendation(drug_name, age, heart_rate)
             
-            # Determine effectiveness label
-            eff_score = stats['avg_effectiveness']
-            if eff_score >= 4.5:
-                eff_label = 'Highly Effective'
-            elif eff_score >= 3.5:
-                eff_label = 'Considerably Effective'
-            elif eff_score >= 2.5:
-                eff_label = 'Moderately Effective'
-            else:
-                eff_label = 'Marginally Effective'
-            
-            # Determine side effect risk
-            se_score = stats['avg_side_effects']
-            if se_score <= 1.5:
-                se_label = 'Low Risk'
-            elif se_score <= 2.5:
-                se_label = 'Mild Risk'
-            elif se_score <= 3.5:
-                se_label = 'Moderate Risk'
-            else:
-                se_label = 'High Risk'
-            
             # Calculate confidence
             confidence = min(0.95, stats['score'] / 15)
             
@@ -415,13 +650,15 @@ class DrugRecommender:
                 'confidence': round(confidence, 2),
                 'dosage': dosage,
                 'frequency': frequency,
-                'effectiveness': eff_label,
-                'side_effects_risk': se_label,
+                'effectiveness': stats['effectiveness_label'],
+                'side_effects_risk': stats['side_effects_label'],
                 'condition_match': stats['condition']
             })
             
             # Get SHAP explanations
-            explanations = self._compute_shap_values(stats)
+            explanations = self._compute_shap_values(
+                stats, shap_matrix[i] if shap_matrix is not None else None
+            )
             
             # Add patient-specific factors to explanations
             explanations.append({
@@ -440,7 +677,9 @@ class DrugRecommender:
             all_explanations.extend(explanations)
             
             # Check interactions
-            interactions = self._check_interactions(drug_name, current_medications, allergies)
+            interactions = self._check_interactions(
+                drug_name, current_medications, allergies, allergy_automaton
+            )
             all_interactions.extend(interactions)
         
         # Ensure we have at least one recommendation
@@ -465,13 +704,17 @@ class DrugRecommender:
             }]
         
         # Normalize explanation influences
-        total_influence = sum(e['influence'] for e in all_explanations)
+        influences = np.fromiter((e['influence'] for e in all_explanations),
+                                 dtype=np.float64, count=len(all_explanations))
+        total_influence = influences.sum()
         if total_influence > 0:
-            for e in all_explanations:
-                e['influence'] = round(e['influence'] / total_influence * 100, 1)
+            influences = np.round(influences * (100.0 / total_influence), 1)
         
-        # Keep top explanations
-        all_explanations = sorted(all_explanations, key=lambda x: x['influence'], reverse=True)[:6]
+        # Keep top explanations; the stable sort keeps the earliest of tied entries
+        top = np.argsort(-influences, kind='stable')[:6]
+        for e, influence in zip(all_explanations, influences.tolist()):
+            e['influence'] = influence
+        all_explanations = [all_explanations[i] for i in top]
         
         return {
             'recommendations': recommendations,